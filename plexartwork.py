@@ -1,7 +1,22 @@
-import requests
-import xml.etree.ElementTree as ET
+import asyncio
+import glob
+import hashlib
+import json
+import multiprocessing
 import os
 import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlencode
+from plexclient import AsyncPlexClient, PlexClient, RequestCounter, discard_temp, iter_xml
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # Only needed for POSTPROCESS
 
 # --- USER SETTINGS ---
 PLEX_URL = "http://your.address:32400"       # Plex server URL
@@ -10,10 +25,71 @@ OUTPUT_DIR = "plex_artwork"                  # Output folder
 SECTION_KEYS = ["1", "2"]                    # Library section keys to process
 MAX_ITEMS = 10                               # Max items per section to process (set to None for all)
 MAX_POSTERS_PER_PROVIDER = 10                # Max agent posters per provider (e.g. TMDB, TVDB, etc.)
+SEASON_POSTERS = True                        # Fetch agent posters per season (one request each); False keeps only the season listing's artwork
+DOWNLOAD_WORKERS = 8                         # Number of artwork downloads to run at the same time
+REQUEST_TIMEOUT = 30                         # Seconds to wait for Plex before a request fails
+PLEX_FORMAT = "xml"                          # Ask Plex for "xml" or "json" (cheaper to decode on large sections)
+PAGE_SIZE = 200                              # Items fetched per page when listing a section
+INCREMENTAL = False                          # Only re-walk items, seasons and artwork that changed since the last run
+DEDUPE_MODE = "hardlink"                     # Byte-identical artwork: "hardlink", "skip", or None to always write
+CHUNK_SIZE = 64 * 1024                       # Bytes read per chunk while downloading
+TRANSCODE = False                            # Download resized copies made by Plex instead of the originals (own state DB)
+TRANSCODE_WIDTH = 1280                       # Transcode: largest width in pixels (aspect ratio is kept)
+TRANSCODE_HEIGHT = 1280                      # Transcode: largest height in pixels
+TRANSCODE_FORMAT = "webp"                    # Transcode: "webp", "jpeg" or "png"
+TRANSCODE_SUFFIX = " - preview"              # Transcode: added to file names so copies sit next to the originals
+POSTPROCESS = False                          # Convert downloaded JPEG/PNG artwork and make thumbnails (needs Pillow)
+POSTPROCESS_DIR = "plex_artwork_web"         # Post-process: output folder, mirroring OUTPUT_DIR
+POSTPROCESS_FORMAT = "webp"                  # Post-process: "webp" or "avif" (avif needs Pillow 11.2+)
+POSTPROCESS_QUALITY = 85                     # Post-process: encoder quality, 1-100
+POSTPROCESS_WORKERS = None                   # Post-process: worker processes (None for one per CPU)
+THUMBNAIL_WIDTH = 300                        # Post-process: thumbnail width in pixels
+PARALLEL_SECTIONS = False                    # Process all sections at the same time instead of one after another
+MAX_IN_FLIGHT = 16                           # Most requests sent to Plex at once, across all sections and workers
+RATE_LIMIT = 50                              # Most requests per second sent to Plex (set to None for no limit)
+MAX_RETRIES = 3                              # Extra attempts after a connection error or 429/5xx answer
+ASYNC_MODE = False                           # Run listing, discovery and downloads as an asyncio pipeline (needs aiohttp)
+ASYNC_DISCOVERY = 16                         # Async mode: items being discovered at the same time
+ASYNC_DOWNLOADS = 64                         # Async mode: artwork downloads at the same time
+ASYNC_MAX_IN_FLIGHT = 100                    # Async mode: most requests sent to Plex at once
+ASYNC_QUEUE_SIZE = 200                       # Async mode: items/jobs buffered between pipeline stages
+
+PLAN_MODE = False                            # Only discover: write PLAN_FILE listing every file a run would download
+PLAN_FILE = os.path.join(OUTPUT_DIR, "artwork_plan.jsonl")
+PLAN_WORKERS = 8                             # Plan mode: items discovered at the same time
+PLAN_HEAD_SIZES = False                      # Plan mode: send a HEAD per file to record its size
+RUN_PLAN = False                             # Download the files listed in PLAN_FILE instead of discovering them
+PROGRESS_INTERVAL = 10                       # Run plan: seconds between throughput reports
+PLAN_OFFSET_FILE = PLAN_FILE + ".offset"     # Run plan: first line not yet finished, so a restart resumes there
+
+STATE_DB = os.path.join(OUTPUT_DIR, "artwork_state.db")
+SHARD = None                                 # (i, N): only handle items hashed to shard i of N (or run with --shard i/N)
+STATE_BATCH_SIZE = 200                       # State writes grouped into one SQLite transaction
 
+# Older processed lists, imported into STATE_DB once on the first run
 PROCESSED_SHOWS_FILE = os.path.join(OUTPUT_DIR, "processed_shows.txt")
 PROCESSED_MOVIES_FILE = os.path.join(OUTPUT_DIR, "processed_movies.txt")
 
+# Shared by the section, discovery and download threads
+plex = PlexClient(
+    PLEX_URL, PLEX_TOKEN,
+    timeout=REQUEST_TIMEOUT,
+    pool_size=MAX_IN_FLIGHT,
+    max_in_flight=MAX_IN_FLIGHT,
+    rate=RATE_LIMIT,
+    retries=MAX_RETRIES,
+    response_format=PLEX_FORMAT
+)
+
+print_lock = threading.Lock()
+
+def log(msg):
+    # Progress lines come from pool threads; print() writes the text and the newline separately,
+    # so each line goes out in one write under a lock
+    with print_lock:
+        sys.stdout.write(f"{msg}\n")
+        sys.stdout.flush()
+
 def sanitize_filename(text):
     return re.sub(r'[^a-zA-Z0-9 .()_-]', '', text)
 
@@ -26,215 +102,1277 @@ def get_file_extension(url, default=".jpg"):
 def safe_year(year):
     return f" ({year})" if year else ""
 
+def fetch_key(key):
+    # With TRANSCODE on, artwork is pulled through Plex's photo transcoder at the configured size
+    if not TRANSCODE:
+        return key
+    params = {
+        "width": TRANSCODE_WIDTH,
+        "height": TRANSCODE_HEIGHT,
+        "minSize": 0,
+        "upscale": 0,
+        "format": TRANSCODE_FORMAT,
+        "url": key
+    }
+    return f"/photo/:/transcode?{urlencode(params)}"
+
+def target_extension(key):
+    if not TRANSCODE:
+        return get_file_extension(key)
+    ext = "jpg" if TRANSCODE_FORMAT == "jpeg" else TRANSCODE_FORMAT
+    return f"{TRANSCODE_SUFFIX}.{ext}"
+
+# Download statuses that count as having the artwork
+SUCCESS_STATUSES = ("done", "linked", "duplicate")
+SUCCESS_PLACEHOLDERS = ", ".join("?" * len(SUCCESS_STATUSES))
+# Seasons share the show's logo and background, so only their own posters are fetched
+SEASON_EXCLUDE_TYPES = ["clearlogo", "background"]
+
 def load_processed_ids(path):
     if not os.path.exists(path):
         return set()
     with open(path, "r") as f:
         return set(line.strip() for line in f if line.strip())
 
-def mark_id_processed(path, ratingKey):
-    with open(path, "a") as f:
-        f.write(f"{ratingKey}\n")
-
-def get_sections():
-    url = f"{PLEX_URL}/library/sections?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
-    sections = []
-    for directory in root.findall(".//Directory"):
-        key = directory.attrib.get("key")
-        title = directory.attrib.get("title")
-        section_type = directory.attrib.get("type")
-        if key in SECTION_KEYS:
-            sections.append({"key": key, "title": title, "type": section_type})
-    return sections
-
-def get_items(section_key, section_type):
-    url = f"{PLEX_URL}/library/sections/{section_key}/all?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
-    items = []
+class StateStore:
+    # SQLite record of items, seasons and their artwork. Writes are batched into
+    # transactions of STATE_BATCH_SIZE and shared by the download worker threads.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            rating_key TEXT PRIMARY KEY,
+            kind TEXT,
+            parent_key TEXT,
+            title TEXT,
+            updated_at TEXT,
+            added_at TEXT,
+            child_count TEXT,
+            processed INTEGER NOT NULL DEFAULT 0,
+            complete INTEGER NOT NULL DEFAULT 0,
+            last_run REAL
+        );
+        CREATE TABLE IF NOT EXISTS artwork (
+            id INTEGER PRIMARY KEY,
+            rating_key TEXT NOT NULL,
+            art_key TEXT NOT NULL,
+            art_type TEXT,
+            provider TEXT,
+            dest_path TEXT,
+            status TEXT,
+            bytes INTEGER,
+            sha256 TEXT,
+            last_run REAL,
+            UNIQUE (rating_key, dest_path)
+        );
+        CREATE INDEX IF NOT EXISTS artwork_by_key ON artwork (rating_key, art_key);
+        CREATE INDEX IF NOT EXISTS artwork_by_hash ON artwork (sha256);
+        CREATE INDEX IF NOT EXISTS artwork_by_path ON artwork (dest_path);
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+    """
+    # Columns added after the first release of the schema: (table, column, type)
+    COLUMNS = [
+        ("artwork", "etag", "TEXT"),
+        ("artwork", "last_modified", "TEXT"),
+    ]
+
+    def __init__(self, path, batch_size=STATE_BATCH_SIZE):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(self.SCHEMA)
+        for table, column, column_type in self.COLUMNS:
+            existing = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.batch_size = batch_size
+        self.pending = 0
+
+    def write(self, sql, params=()):
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.conn.commit()
+                self.pending = 0
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def import_legacy(self, shows_file, movies_file):
+        # One-time import of processed_*.txt
+        if self.query("SELECT 1 FROM meta WHERE name = 'legacy_imported'"):
+            return
+        for path, kind in ((shows_file, "show"), (movies_file, "movie")):
+            for ratingKey in load_processed_ids(path):
+                self.write(
+                    "INSERT INTO items (rating_key, kind, processed) VALUES (?, ?, 1) "
+                    "ON CONFLICT (rating_key) DO UPDATE SET processed = 1",
+                    (ratingKey, kind)
+                )
+        self.write("INSERT INTO meta (name, value) VALUES ('legacy_imported', ?)", (str(time.time()),))
+        self.commit()
+
+    def processed_ids(self, kind):
+        rows = self.query("SELECT rating_key FROM items WHERE kind = ? AND processed = 1", (kind,))
+        return set(row[0] for row in rows)
+
+    def is_unchanged(self, entry):
+        # An entry is unchanged when its timestamps match the last complete run
+        rows = self.query(
+            "SELECT updated_at, added_at, child_count FROM items WHERE rating_key = ? AND complete = 1",
+            (entry["ratingKey"],)
+        )
+        if not rows:
+            return False
+        return rows[0] == (entry.get("updatedAt", ""), entry.get("addedAt", ""), entry.get("childCount", ""))
+
+    def known_artwork(self, ratingKey):
+        rows = self.query(
+            f"SELECT art_key FROM artwork WHERE rating_key = ? AND status IN ({SUCCESS_PLACEHOLDERS})",
+            (ratingKey, *SUCCESS_STATUSES)
+        )
+        return set(row[0] for row in rows)
+
+    def file_record(self, dest_path):
+        rows = self.query(
+            "SELECT bytes, sha256, etag, last_modified FROM artwork "
+            f"WHERE dest_path = ? AND status IN ({SUCCESS_PLACEHOLDERS}) ORDER BY last_run DESC LIMIT 1",
+            (dest_path, *SUCCESS_STATUSES)
+        )
+        if not rows:
+            return None
+        return dict(zip(("bytes", "sha256", "etag", "last_modified"), rows[0]))
+
+    def written_hashes(self):
+        # Oldest first, so the latest content recorded for a path is what the index ends up with
+        return self.query(
+            "SELECT sha256, dest_path FROM artwork WHERE status = 'done' AND sha256 IS NOT NULL ORDER BY last_run"
+        )
+
+    def record_item(self, entry, kind, parent_key, complete, processed):
+        self.write(
+            "INSERT INTO items (rating_key, kind, parent_key, title, updated_at, added_at, child_count, "
+            "processed, complete, last_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (rating_key) DO UPDATE SET kind = COALESCE(excluded.kind, kind), "
+            "parent_key = COALESCE(excluded.parent_key, parent_key), title = COALESCE(excluded.title, title), "
+            "updated_at = excluded.updated_at, added_at = excluded.added_at, child_count = excluded.child_count, "
+            "processed = MAX(processed, excluded.processed), complete = excluded.complete, last_run = excluded.last_run",
+            (
+                entry["ratingKey"], kind, parent_key, entry.get("title"),
+                entry.get("updatedAt", ""), entry.get("addedAt", ""), entry.get("childCount", ""),
+                int(processed), int(complete), time.time()
+            )
+        )
+
+    def record_artwork(self, ratingKey, result):
+        self.write(
+            "INSERT INTO artwork (rating_key, art_key, art_type, provider, dest_path, status, bytes, sha256, "
+            "etag, last_modified, last_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (rating_key, dest_path) DO UPDATE SET art_key = excluded.art_key, "
+            "art_type = excluded.art_type, provider = excluded.provider, status = excluded.status, "
+            "bytes = COALESCE(excluded.bytes, bytes), sha256 = COALESCE(excluded.sha256, sha256), "
+            "etag = COALESCE(excluded.etag, etag), last_modified = COALESCE(excluded.last_modified, last_modified), "
+            "last_run = excluded.last_run",
+            (
+                ratingKey, result["key"], result["type"], result["provider"], result["dest_path"],
+                result["status"], result["bytes"], result["sha256"], result["etag"], result["last_modified"],
+                time.time()
+            )
+        )
+
+    def merge(self, path):
+        # Folds another state DB (a shard's) into this one; for rows in both, the most recent run wins
+        items = "rating_key, kind, parent_key, title, updated_at, added_at, child_count, processed, complete, last_run"
+        artwork = (
+            "rating_key, art_key, art_type, provider, dest_path, status, bytes, sha256, etag, last_modified, last_run"
+        )
+        with self.lock:
+            self.conn.commit()
+            self.conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                self.conn.execute(
+                    f"INSERT INTO items ({items}) SELECT {items} FROM shard.items WHERE true "
+                    "ON CONFLICT (rating_key) DO UPDATE SET kind = excluded.kind, parent_key = excluded.parent_key, "
+                    "title = excluded.title, updated_at = excluded.updated_at, added_at = excluded.added_at, "
+                    "child_count = excluded.child_count, processed = MAX(processed, excluded.processed), "
+                    "complete = excluded.complete, last_run = excluded.last_run "
+                    "WHERE excluded.last_run >= COALESCE(items.last_run, 0)"
+                )
+                self.conn.execute(
+                    f"INSERT INTO artwork ({artwork}) SELECT {artwork} FROM shard.artwork WHERE true "
+                    "ON CONFLICT (rating_key, dest_path) DO UPDATE SET art_key = excluded.art_key, "
+                    "art_type = excluded.art_type, provider = excluded.provider, status = excluded.status, "
+                    "bytes = excluded.bytes, sha256 = excluded.sha256, etag = excluded.etag, "
+                    "last_modified = excluded.last_modified, last_run = excluded.last_run "
+                    "WHERE excluded.last_run >= COALESCE(artwork.last_run, 0)"
+                )
+                self.conn.commit()
+            finally:
+                self.conn.execute("DETACH DATABASE shard")
+
+class HashIndex:
+    # sha256 -> path of a file already written with that content, plus path -> sha256 of what it holds now
+    def __init__(self):
+        self.paths = {}
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        for digest, path in rows:
+            self.add(digest, path)
+
+    def find(self, digest):
+        with self.lock:
+            path = self.paths.get(digest)
+            current = self.digests.get(path)
+        if path and current == digest and os.path.exists(path):
+            return path
+        return None
+
+    def add(self, digest, path):
+        # path now holds digest, so whatever it was indexed under before no longer points at it
+        with self.lock:
+            previous = self.digests.get(path)
+            if previous and previous != digest and self.paths.get(previous) == path:
+                del self.paths[previous]
+            self.digests[path] = digest
+            self.paths.setdefault(digest, path)
+
+hash_index = HashIndex()
+
+def web_paths(dest_path):
+    # Converted image and thumbnail paths under POSTPROCESS_DIR for a file under OUTPUT_DIR
+    base = os.path.splitext(os.path.join(POSTPROCESS_DIR, os.path.relpath(dest_path, OUTPUT_DIR)))[0]
+    return f"{base}.{POSTPROCESS_FORMAT}", f"{base} - thumb.{POSTPROCESS_FORMAT}"
+
+def convert_image(src, dest, thumb_dest, image_format, thumb_width, quality):
+    # Runs in a worker process. Returns False when both outputs are already newer than src.
+    src_mtime = os.path.getmtime(src)
+    if all(os.path.exists(path) and os.path.getmtime(path) >= src_mtime for path in (dest, thumb_dest)):
+        return False
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with Image.open(src) as img:
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("LA", "PA", "P") else "RGB")
+        for path, width in ((dest, None), (thumb_dest, thumb_width)):
+            if width and img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            img.save(path + ".part", image_format.upper(), quality=quality)
+            os.replace(path + ".part", path)
+    return True
+
+class PostProcessor:
+    # Converts finished artwork in worker processes. Items hand over their results as they complete,
+    # so image work runs next to the downloads instead of after them or on the download threads.
+    def __init__(self):
+        self.executor = None
+
+    def start(self):
+        if Image is None:
+            raise RuntimeError("POSTPROCESS needs Pillow (pip install Pillow)")
+        # Spawned, not forked: the pool first starts from a download thread's callback, and forking
+        # a process that has other threads running can copy locks they hold
+        self.executor = ProcessPoolExecutor(
+            max_workers=POSTPROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def submit(self, stats, results):
+        if not self.executor:
+            return
+        for result in results:
+            src = result["dest_path"]
+            if result["status"] not in ("done", "linked") or not src.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            dest, thumb_dest = web_paths(src)
+            future = self.executor.submit(
+                convert_image, src, dest, thumb_dest, POSTPROCESS_FORMAT, THUMBNAIL_WIDTH, POSTPROCESS_QUALITY
+            )
+            future.add_done_callback(lambda f, src=src: self.finished(stats, src, f))
+
+    def finished(self, stats, src, future):
+        try:
+            if future.result():
+                stats.add("converted")
+        except Exception as e:
+            log(f"Exception: converting {os.path.basename(src)} - {e}")
+            stats.add("convert_failed")
+
+    def shutdown(self):
+        # Waits for queued conversions
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+postprocessor = PostProcessor()
+
+def text(value):
+    # JSON gives numbers where XML gives strings; keep everything as XML-style strings
+    return "" if value is None else str(value)
+
+def state_db_path():
+    # Transcoded copies keep their own state DB, so items already archived as originals still get
+    # their previews, and each transcode size/format is tracked on its own
+    if not TRANSCODE:
+        return STATE_DB
+    base, ext = os.path.splitext(STATE_DB)
+    return f"{base}.transcode-{TRANSCODE_WIDTH}x{TRANSCODE_HEIGHT}-{TRANSCODE_FORMAT}{ext}"
+
+def shard_path(path):
+    # Per-shard name for state and plan files, so shards never share one
+    if not SHARD:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{SHARD[0]}of{SHARD[1]}{ext}"
+
+def in_shard(item):
+    # Stable across runs and machines (unlike hash()), so every shard agrees on the split
+    if not SHARD:
+        return True
+    index, count = SHARD
+    digest = hashlib.sha1(item["ratingKey"].encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count == index - 1
+
+def parse_shard(value):
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not match or not 1 <= int(match[1]) <= int(match[2]):
+        sys.exit(f"Invalid shard {value!r}, expected i/N with 1 <= i <= N")
+    return int(match[1]), int(match[2])
+
+# The parse_* functions take raw bytes or a streamed body and read it with iter_xml,
+# keeping only the attributes they need instead of building a tree.
+
+def item_tag(section_type):
     if section_type == "movie":
-        for item in root.findall(".//Video"):
-            ratingKey = item.attrib.get("ratingKey")
-            title = item.attrib.get("title")
-            year = item.attrib.get("year", "")
-            items.append({"ratingKey": ratingKey, "title": title, "year": year})
-    elif section_type == "show":
-        for item in root.findall(".//Directory"):
-            ratingKey = item.attrib.get("ratingKey")
-            title = item.attrib.get("title")
-            year = item.attrib.get("year", "")
-            items.append({"ratingKey": ratingKey, "title": title, "year": year})
-    return items
+        return "Video"
+    if section_type == "show":
+        return "Directory"
+    return None
+
+def page_params(start, limit):
+    size = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - start)
+    return {"X-Plex-Container-Start": start, "X-Plex-Container-Size": size}
+
+def item_from(attrib):
+    ratingKey = text(attrib.get("ratingKey"))
+    title = attrib.get("title")
+    year = text(attrib.get("year", ""))
+    return {
+        "ratingKey": ratingKey,
+        "title": title,
+        "year": year,
+        "updatedAt": text(attrib.get("updatedAt", "")),
+        "addedAt": text(attrib.get("addedAt", "")),
+        "childCount": text(attrib.get("childCount", ""))
+    }
+
+def parse_items_page(data, section_type):
+    # Returns (items, page_size, total_size) for one page of a section listing
+    items = []
+    container = {}
+    for tag, attrib, _ in iter_xml(data, {item_tag(section_type), "MediaContainer"}):
+        if tag == "MediaContainer":
+            container = attrib
+            continue
+        items.append(item_from(attrib))
+    total = container.get("totalSize")
+    return items, int(container.get("size", len(items))), int(total) if total else None
+
+def parse_items_page_json(container):
+    items = [item_from(attrib) for attrib in container.get("Metadata", [])]
+    total = container.get("totalSize")
+    return items, int(container.get("size", len(items))), int(total) if total else None
+
+def last_page(params, page_size, total):
+    start = params["X-Plex-Container-Start"] + page_size
+    return page_size < params["X-Plex-Container-Size"] or (total is not None and start >= total)
+
+def get_items(section_key, section_type, limit=None):
+    # Yields items a page at a time, so processing starts on the first page and limit stops the listing early
+    if not item_tag(section_type):
+        return
+    start = 0
+    while limit is None or start < limit:
+        params = page_params(start, limit)
+        items, page_size, total = plex.get_container(
+            f"/library/sections/{section_key}/all",
+            lambda body: parse_items_page(body, section_type),
+            parse_items_page_json,
+            params=params
+        )
+        yield from filter(in_shard, items)
+        start += page_size
+        if last_page(params, page_size, total):
+            break
 
 def get_seasons(show_rating_key):
-    url = f"{PLEX_URL}/library/metadata/{show_rating_key}/children?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
+    # includeImages lists each season's artwork with the season itself, so no per-season metadata call is needed
+    return plex.get_container(
+        f"/library/metadata/{show_rating_key}/children",
+        parse_seasons,
+        parse_seasons_json,
+        params={"includeImages": 1}
+    )
+
+def parse_seasons(data):
+    # A season's <Image> children close before the season element itself
     seasons = []
-    for elem in root.findall(".//Directory"):
-        if elem.attrib.get("type") == "season":
-            ratingKey = elem.attrib.get("ratingKey")
-            title = elem.attrib.get("title")
-            index = elem.attrib.get("index", "")
-            year = elem.attrib.get("year", "")
-            seasons.append({
-                "ratingKey": ratingKey,
-                "title": title,
-                "index": index,
-                "year": year
-            })
+    images = []
+    for tag, attrib, _ in iter_xml(data, {"Directory", "Image"}):
+        if tag == "Image":
+            images.extend(image_artwork(attrib, SEASON_EXCLUDE_TYPES))
+            continue
+        if attrib.get("type") == "season":
+            seasons.append(season_from(attrib, attribute_artwork(attrib, SEASON_EXCLUDE_TYPES) + images))
+        images = []
     return seasons
 
+def parse_seasons_json(container):
+    seasons = []
+    for attrib in container.get("Metadata", []):
+        if attrib.get("type") == "season":
+            artwork = attribute_artwork(attrib, SEASON_EXCLUDE_TYPES)
+            for image in attrib.get("Image", []):
+                artwork.extend(image_artwork(image, SEASON_EXCLUDE_TYPES))
+            seasons.append(season_from(attrib, artwork))
+    return seasons
+
+def season_from(attrib, artwork):
+    ratingKey = text(attrib.get("ratingKey"))
+    title = attrib.get("title")
+    index = text(attrib.get("index", ""))
+    year = text(attrib.get("year", ""))
+    return {
+        "ratingKey": ratingKey,
+        "title": title,
+        "index": index,
+        "year": year,
+        "updatedAt": text(attrib.get("updatedAt", "")),
+        "addedAt": text(attrib.get("addedAt", "")),
+        "artwork": artwork
+    }
+
+def get_posters(ratingKey):
+    return plex.get_container(f"/library/metadata/{ratingKey}/posters", parse_posters, parse_posters_json)
+
 def get_artwork(ratingKey, exclude_types=None):
+    posters = get_posters(ratingKey)
+    artwork = plex.get_container(
+        f"/library/metadata/{ratingKey}",
+        lambda body: parse_metadata_artwork(body, exclude_types),
+        lambda container: parse_metadata_artwork_json(container, exclude_types)
+    )
+    return posters + artwork
+
+def parse_posters(data):
+    return limit_posters(attrib for tag, attrib, _ in iter_xml(data, {"Photo"}))
+
+def parse_posters_json(container):
+    return limit_posters(container.get("Metadata", []) + container.get("Photo", []))
+
+def limit_posters(photos):
     # 1. Posters (agent ones), up to MAX_POSTERS_PER_PROVIDER per provider
-    posters_url = f"{PLEX_URL}/library/metadata/{ratingKey}/posters?X-Plex-Token={PLEX_TOKEN}"
-    posters_resp = requests.get(posters_url)
-    posters_root = ET.fromstring(posters_resp.text)
     posters_by_provider = {}
-    for photo in posters_root.findall(".//Photo"):
-        provider = photo.attrib.get("provider")
-        key = photo.attrib.get("key")
+    for attrib in photos:
+        provider = attrib.get("provider")
+        key = attrib.get("key")
         if provider and key:
             posters_by_provider.setdefault(provider, []).append({"type": "poster", "provider": provider, "key": key})
     # Only keep up to MAX_POSTERS_PER_PROVIDER posters per provider
     limited_posters = []
     for provider_posters in posters_by_provider.values():
         limited_posters.extend(provider_posters[:MAX_POSTERS_PER_PROVIDER])
+    return limited_posters
 
-    # 2. Other artwork from metadata endpoint (attributes and <Image> tags)
-    artwork = []
+# 2. Other artwork from metadata endpoint (attributes and <Image> tags)
+
+def attribute_artwork(attrib, exclude_types):
     # a) From attributes (EXCLUDING "thumb" and "coverPoster" and any passed types)
     artwork_attrs = [
         "clearLogo", "background"
     ]
-    url = f"{PLEX_URL}/library/metadata/{ratingKey}?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
-    for elem in root.iter():
-        if elem.tag not in ("Directory", "Video"):
-            continue
-        for attr in artwork_attrs:
-            if attr in elem.attrib:
-                if exclude_types and attr.lower() in exclude_types:
-                    continue
-                artwork.append({"type": attr.lower(), "provider": "plex", "key": elem.attrib[attr]})
+    artwork = []
+    for attr in artwork_attrs:
+        if attr in attrib:
+            if exclude_types and attr.lower() in exclude_types:
+                continue
+            artwork.append({"type": attr.lower(), "provider": "plex", "key": attrib[attr]})
+    return artwork
 
+def image_artwork(attrib, exclude_types):
     # b) From <Image type="..." url="..."/> child elements (EXCLUDING type="thumb", "coverPoster", and any passed types)
-    for image in root.findall(".//Image"):
-        img_type = image.attrib.get("type")
-        url = image.attrib.get("url")
-        if img_type and url:
-            lower_type = img_type.lower()
-            if lower_type in ["thumb", "coverposter"]:
-                continue
-            if exclude_types and lower_type in exclude_types:
-                continue
-            artwork.append({"type": lower_type, "provider": "plex", "key": url})
+    img_type = attrib.get("type")
+    url = attrib.get("url")
+    if img_type and url:
+        lower_type = img_type.lower()
+        if lower_type in ["thumb", "coverposter"]:
+            return []
+        if exclude_types and lower_type in exclude_types:
+            return []
+        return [{"type": lower_type, "provider": "plex", "key": url}]
+    return []
+
+def parse_metadata_artwork(data, exclude_types=None):
+    from_attrs = []
+    from_images = []
+    for tag, attrib, _ in iter_xml(data, {"Directory", "Video", "Image"}):
+        if tag == "Image":
+            from_images.extend(image_artwork(attrib, exclude_types))
+        else:
+            from_attrs.extend(attribute_artwork(attrib, exclude_types))
+    return from_attrs + from_images
+
+def parse_metadata_artwork_json(container, exclude_types=None):
+    from_attrs = []
+    from_images = []
+    for entry in container.get("Metadata", []):
+        from_attrs.extend(attribute_artwork(entry, exclude_types))
+        for image in entry.get("Image", []):
+            from_images.extend(image_artwork(image, exclude_types))
+    return from_attrs + from_images
 
-    return limited_posters + artwork
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
-def download_artwork(item_folder, index, item_title, item_year, art_type, provider, key):
+def conditional_headers(store, dest_path, result):
+    # For a file already on disk, return headers for a conditional GET built from the ETag/Last-Modified
+    # seen last time, or None when there is nothing to validate against and a HEAD size check is needed.
+    known = store.file_record(dest_path) if store else None
+    if known:
+        result.update(known)
+    if known and known["bytes"] == os.path.getsize(dest_path) and (known["etag"] or known["last_modified"]):
+        headers = {}
+        if known["etag"]:
+            headers["If-None-Match"] = known["etag"]
+        if known["last_modified"]:
+            headers["If-Modified-Since"] = known["last_modified"]
+        return headers
+    return None
+
+def head_confirms(status, headers, dest_path, result):
+    # A HEAD answer whose Content-Length matches the file on disk means it is already complete
+    length = headers.get("Content-Length")
+    size_on_disk = os.path.getsize(dest_path)
+    if status != 200 or not length or int(length) != size_on_disk:
+        return False
+    result.update(
+        status="done",
+        bytes=size_on_disk,
+        sha256=result["sha256"] or file_sha256(dest_path),
+        etag=headers.get("ETag"),
+        last_modified=headers.get("Last-Modified")
+    )
+    return True
+
+def existing_headers(store, dest_path, result):
+    # Headers for the GET, or None when only a HEAD can tell whether the file on disk is current
+    if not os.path.exists(dest_path):
+        return {}
+    return conditional_headers(store, dest_path, result)
+
+def artwork_target(item_folder, index, item_title, item_year, art_type, provider, key):
     safe_title = sanitize_filename(item_title)
     safe_provider = sanitize_filename(provider)
     safe_type = sanitize_filename(art_type)
     safe_year_str = safe_year(item_year)
-    ext = get_file_extension(key)
+    ext = target_extension(key)
     filename = f"{safe_title}{safe_year_str} - {safe_type} - {safe_provider} - file{index}{ext}"
     dest_path = os.path.join(item_folder, filename)
+    # result["key"] is what gets requested and recorded, so transcoded copies are tracked apart from originals
+    return filename, dest_path, new_result(fetch_key(key), art_type, provider, dest_path)
 
-    if key.startswith("http://") or key.startswith("https://"):
-        url = key
-    else:
-        url = f"{PLEX_URL}{key}?X-Plex-Token={PLEX_TOKEN}"
+def new_result(key, art_type, provider, dest_path):
+    return {
+        "key": key,
+        "type": art_type,
+        "provider": provider,
+        "dest_path": dest_path,
+        "status": "failed",
+        "bytes": None,
+        "sha256": None,
+        "etag": None,
+        "last_modified": None
+    }
+
+def finish_download(temp_path, size, digest, dest_path, filename, result):
+    # Hashed while streaming so duplicates are spotted before anything lands at dest_path
+    if not size:
+        discard_temp(temp_path)
+        log(f"Failed: {filename} [empty response]")
+        return result
+    result.update(bytes=size, sha256=digest)
+    existing = hash_index.find(digest) if DEDUPE_MODE else None
+    if existing and os.path.abspath(existing) == os.path.abspath(dest_path):
+        existing = None
+    if existing and DEDUPE_MODE == "skip":
+        discard_temp(temp_path)
+        result["status"] = "duplicate"
+        log(f"Duplicate: {filename} (same as {os.path.basename(existing)})")
+        return result
+    if existing and DEDUPE_MODE == "hardlink":
+        try:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            os.link(existing, dest_path)
+            hash_index.add(digest, dest_path)
+            discard_temp(temp_path)
+            result["status"] = "linked"
+            log(f"Linked: {filename} (same as {os.path.basename(existing)})")
+            return result
+        except OSError:
+            pass  # Filesystem without hardlinks, fall back to writing a copy
+    os.replace(temp_path, dest_path)
+    hash_index.add(digest, dest_path)
+    result["status"] = "done"
+    log(f"Downloaded: {filename}")
+    return result
+
+def download_outcome(status, resp_headers, temp_path, size, digest, dest_path, filename, result):
+    # Shared by the threaded and async downloaders once the GET has answered
+    if status == 304:
+        result["status"] = "done"
+        log(f"Up to date: {filename}")
+        return result
+    if status == 200:
+        result.update(etag=resp_headers.get("ETag"), last_modified=resp_headers.get("Last-Modified"))
+        return finish_download(temp_path, size, digest, dest_path, filename, result)
+    log(f"Failed: {filename} [{status}]")
+    return result
+
+def download_artwork(item_folder, index, item_title, item_year, art_type, provider, key, store=None):
+    filename, dest_path, result = artwork_target(item_folder, index, item_title, item_year, art_type, provider, key)
+    return download_file(result["key"], dest_path, filename, result, store)
+
+def download_planned(url, dest_path, art_type, provider, store=None):
+    # A manifest file is fetched exactly as planned, whatever the local TRANSCODE settings are
+    result = new_result(url, art_type, provider, dest_path)
+    return download_file(url, dest_path, os.path.basename(dest_path), result, store)
+
+def download_file(key, dest_path, filename, result, store):
     try:
-        resp = requests.get(url)
-        if resp.status_code == 200 and resp.content:
-            with open(dest_path, "wb") as f:
-                f.write(resp.content)
-            print(f"Downloaded: {filename}")
-        else:
-            print(f"Failed: {filename} [{resp.status_code}]")
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        # Resumed runs only transfer what is missing or changed on the server
+        headers = existing_headers(store, dest_path, result)
+        if headers is None:
+            head = plex.head(key)
+            if head_confirms(head.status_code, head.headers, dest_path, result):
+                log(f"Up to date: {filename}")
+                return result
+            headers = {}
+        response = plex.download(key, dest_path, headers, CHUNK_SIZE)
+        return download_outcome(*response, dest_path, filename, result)
     except Exception as e:
-        print(f"Exception: {filename} - {e}")
+        log(f"Exception: {filename} - {e}")
+    return result
+
+def build_download_jobs(folder, title, year, artwork):
+    # Group by (type, provider) for indexing
+    group = {}
+    for art in artwork:
+        k = (art["type"], art["provider"])
+        group.setdefault(k, []).append(art)
+    jobs = []
+    for (art_type, provider), arts in group.items():
+        for idx, art in enumerate(arts, 1):
+            jobs.append((folder, idx, title, year, art_type, provider, art["key"]))
+    return jobs
+
+def submit_downloads(executor, store, jobs, on_complete, download=download_artwork):
+    # Queue an item's downloads and call on_complete(results) once all of them have finished
+    if not jobs:
+        on_complete([])
+        return
+    futures = []
+    remaining = [len(jobs)]
+    lock = threading.Lock()
+
+    def job_done(_):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            on_complete([f.result() for f in futures])
+
+    for job in jobs:
+        futures.append(executor.submit(download, *job, store=store))
+    for future in futures:
+        future.add_done_callback(job_done)
+
+def filter_known(store, jobs, ratingKey):
+    # In incremental mode, skip artwork keys that were already fetched for this item
+    if not INCREMENTAL:
+        return jobs
+    known = store.known_artwork(ratingKey)
+    return [job for job in jobs if fetch_key(job[-1]) not in known]
+
+class SectionStats:
+    # Per-section counters, updated from download callbacks on worker threads
+    def __init__(self):
+        self.counts = {
+            "items": 0, "skipped": 0, "downloaded": 0, "failed": 0, "requests": 0, "converted": 0, "convert_failed": 0,
+            "planned": 0, "planned_bytes": 0, "unsized": 0
+        }
+        self.lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+def item_finished(store, stats, section_type, item, item_found, season_parts):
+    # Per-item bookkeeping, run once every download for the item (and its seasons) has finished.
+    # season_parts holds (season, label, found, start, end); start:end is the season's slice of results.
+    def on_complete(results):
+        item_end = season_parts[0][3] if season_parts else len(results)
+        if not item_found:
+            log(f"No artwork for {item['title']} ({item['year']})")
+        for result in results[:item_end]:
+            store.record_artwork(item["ratingKey"], result)
+        for season, label, found, start, end in season_parts:
+            if not found:
+                log(f"No artwork for {label}")
+            for result in results[start:end]:
+                store.record_artwork(season["ratingKey"], result)
+            complete = all(r["status"] in SUCCESS_STATUSES for r in results[start:end])
+            store.record_item(season, "season", item["ratingKey"], complete, True)
+        # Items with failed downloads stay unprocessed so the next run retries them
+        complete = all(r["status"] in SUCCESS_STATUSES for r in results)
+        store.record_item(item, section_type, None, complete, complete)
+        succeeded = sum(1 for r in results if r["status"] in SUCCESS_STATUSES)
+        stats.add("downloaded", succeeded)
+        stats.add("failed", len(results) - succeeded)
+        postprocessor.submit(stats, results)
+    return on_complete
+
+def section_folder_name(section_type):
+    return "Movies" if section_type == "movie" else "TV Shows"
+
+def should_skip(store, stats, section_type, item, processed_shows, processed_movies):
+    # Resume logic for both shows and movies
+    stats.add("items")
+    if INCREMENTAL:
+        if store.is_unchanged(item):
+            log(f"Skipping unchanged {section_type}: {item['title']} ({item['year']})")
+            stats.add("skipped")
+            return True
+    elif section_type == "show" and item["ratingKey"] in processed_shows:
+        log(f"Skipping already processed show: {item['title']} ({item['year']})")
+        stats.add("skipped")
+        return True
+    elif section_type == "movie" and item["ratingKey"] in processed_movies:
+        log(f"Skipping already processed movie: {item['title']} ({item['year']})")
+        stats.add("skipped")
+        return True
+    return False
+
+def changed_seasons(store, seasons):
+    if not INCREMENTAL:
+        return seasons
+    return [season for season in seasons if not store.is_unchanged(season)]
+
+def plan_item(store, section_folder, item, artwork, season_artwork):
+    # Turns discovered artwork into download jobs. Returns (jobs, item_found, season_parts).
+    folder_name = sanitize_filename(item['title'])
+    if item['year']:
+        folder_name += f" ({item['year']})"
+    item_folder = os.path.join(OUTPUT_DIR, section_folder, folder_name)
+    # Show/movie-level artwork
+    item_jobs = build_download_jobs(item_folder, item['title'], item['year'], artwork)
+    jobs = filter_known(store, item_jobs, item['ratingKey'])
+    # ---- SEASON ARTWORK FOR SHOWS ----
+    season_parts = []
+    for season, artwork in season_artwork:
+        season_folder_name = folder_name + f"/Season {season['index']}"
+        season_folder = os.path.join(OUTPUT_DIR, section_folder, season_folder_name)
+        season_jobs = build_download_jobs(
+            season_folder,
+            f"{item['title']} - Season {season['index']}",
+            season['year'],
+            artwork
+        )
+        label = f"{item['title']} Season {season['index']}"
+        start = len(jobs)
+        jobs.extend(filter_known(store, season_jobs, season['ratingKey']))
+        season_parts.append((season, label, bool(season_jobs), start, len(jobs)))
+    return jobs, bool(item_jobs), season_parts
+
+def report_requests(stats, section_type, item, seasons, counter):
+    # Per-season metadata lookups used to cost two requests per season plus the listing
+    before = 2 + (1 + 2 * len(seasons) if section_type == "show" else 0)
+    stats.add("requests", counter.count)
+    log(f"Discovered {item['title']} ({item['year']}) in {counter.count} requests (was {before})")
+
+def discover_item(store, stats, section_type, section_folder, item):
+    with RequestCounter() as counter:
+        artwork = get_artwork(item['ratingKey'])
+        season_artwork = []
+        if section_type == "show":
+            for season in changed_seasons(store, get_seasons(item['ratingKey'])):
+                posters = get_posters(season['ratingKey']) if SEASON_POSTERS else []
+                season_artwork.append((season, posters + season['artwork']))
+    report_requests(stats, section_type, item, season_artwork, counter)
+    return plan_item(store, section_folder, item, artwork, season_artwork)
+
+def process_section(executor, store, section, processed_shows, processed_movies, stats):
+    section_type = section["type"]
+    section_folder = section_folder_name(section_type)
+    log(f"\nScanning {section['title']} ({section_folder})")
+    for item in get_items(section["key"], section_type, limit=MAX_ITEMS or None):
+        if should_skip(store, stats, section_type, item, processed_shows, processed_movies):
+            continue
+        try:
+            jobs, item_found, season_parts = discover_item(store, stats, section_type, section_folder, item)
+        except Exception as e:
+            log(f"Exception: discovery for {item['title']} ({item['year']}) - {e}")
+            continue
+        submit_downloads(executor, store, jobs, item_finished(store, stats, section_type, item, item_found, season_parts))
+
+# --- ASYNC PIPELINE ---
+# Same discovery and bookkeeping as above, run as connected stages on one event loop:
+# section listing -> item queue -> discovery workers -> job queue -> download workers.
+
+async def get_items_async(aplex, section_key, section_type, limit=None):
+    if not item_tag(section_type):
+        return
+    start = 0
+    while limit is None or start < limit:
+        params = page_params(start, limit)
+        items, page_size, total = await aplex.fetch_container(
+            f"/library/sections/{section_key}/all",
+            lambda body: parse_items_page(body, section_type),
+            parse_items_page_json,
+            params=params
+        )
+        for item in filter(in_shard, items):
+            yield item
+        start += page_size
+        if last_page(params, page_size, total):
+            break
+
+async def get_seasons_async(aplex, show_rating_key):
+    return await aplex.fetch_container(
+        f"/library/metadata/{show_rating_key}/children",
+        parse_seasons,
+        parse_seasons_json,
+        params={"includeImages": 1}
+    )
+
+async def get_posters_async(aplex, ratingKey):
+    return await aplex.fetch_container(f"/library/metadata/{ratingKey}/posters", parse_posters, parse_posters_json)
+
+async def get_artwork_async(aplex, ratingKey, exclude_types=None):
+    posters, artwork = await asyncio.gather(
+        get_posters_async(aplex, ratingKey),
+        aplex.fetch_container(
+            f"/library/metadata/{ratingKey}",
+            lambda body: parse_metadata_artwork(body, exclude_types),
+            lambda container: parse_metadata_artwork_json(container, exclude_types)
+        )
+    )
+    return posters + artwork
+
+async def season_artwork_async(aplex, season):
+    posters = await get_posters_async(aplex, season['ratingKey']) if SEASON_POSTERS else []
+    return season, posters + season['artwork']
+
+async def discover_item_async(aplex, store, stats, section_type, section_folder, item):
+    with RequestCounter() as counter:
+        seasons = []
+        if section_type == "show":
+            seasons = changed_seasons(store, await get_seasons_async(aplex, item['ratingKey']))
+        artwork, *season_artwork = await asyncio.gather(
+            get_artwork_async(aplex, item['ratingKey']),
+            *(season_artwork_async(aplex, season) for season in seasons)
+        )
+    report_requests(stats, section_type, item, season_artwork, counter)
+    return plan_item(store, section_folder, item, artwork, season_artwork)
+
+async def download_artwork_async(aplex, job, store):
+    item_folder, index, item_title, item_year, art_type, provider, key = job
+    filename, dest_path, result = artwork_target(item_folder, index, item_title, item_year, art_type, provider, key)
+    key = result["key"]
+    try:
+        os.makedirs(item_folder, exist_ok=True)
+        headers = existing_headers(store, dest_path, result)
+        if headers is None:
+            status, head_headers = await aplex.head(key)
+            if head_confirms(status, head_headers, dest_path, result):
+                log(f"Up to date: {filename}")
+                return result
+            headers = {}
+        response = await aplex.download(key, dest_path, headers, CHUNK_SIZE)
+        return download_outcome(*response, dest_path, filename, result)
+    except Exception as e:
+        log(f"Exception: {filename} - {e}")
+    return result
+
+class PendingItem:
+    # Collects an item's download results in job order until the last one arrives
+    def __init__(self, count, on_complete):
+        self.results = [None] * count
+        self.remaining = count
+        self.on_complete = on_complete
+
+    def done(self, position, result):
+        self.results[position] = result
+        self.remaining -= 1
+        if not self.remaining:
+            self.on_complete(self.results)
+
+async def run_async_pipeline(store, sections, summary, processed_shows, processed_movies):
+    item_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    job_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+
+    aplex_client = AsyncPlexClient(
+        PLEX_URL, PLEX_TOKEN,
+        timeout=REQUEST_TIMEOUT,
+        max_in_flight=ASYNC_MAX_IN_FLIGHT,
+        rate=RATE_LIMIT,
+        retries=MAX_RETRIES,
+        response_format=PLEX_FORMAT
+    )
+    async with aplex_client as aplex:
+        async def list_section(section):
+            section_folder = section_folder_name(section["type"])
+            log(f"\nScanning {section['title']} ({section_folder})")
+            async for item in get_items_async(aplex, section["key"], section["type"], limit=MAX_ITEMS or None):
+                await item_queue.put((section, item))
+
+        async def list_sections():
+            if PARALLEL_SECTIONS:
+                await asyncio.gather(*(list_section(section) for section in sections))
+            else:
+                for section in sections:
+                    await list_section(section)
+
+        async def discover():
+            while True:
+                entry = await item_queue.get()
+                if entry is None:
+                    return
+                section, item = entry
+                section_type = section["type"]
+                stats = summary[section["title"]]
+                if should_skip(store, stats, section_type, item, processed_shows, processed_movies):
+                    continue
+                try:
+                    jobs, item_found, season_parts = await discover_item_async(
+                        aplex, store, stats, section_type, section_folder_name(section_type), item
+                    )
+                except Exception as e:
+                    log(f"Exception: discovery for {item['title']} ({item['year']}) - {e}")
+                    continue
+                on_complete = item_finished(store, stats, section_type, item, item_found, season_parts)
+                if not jobs:
+                    on_complete([])
+                    continue
+                pending = PendingItem(len(jobs), on_complete)
+                for position, job in enumerate(jobs):
+                    await job_queue.put((pending, position, job))
+
+        async def download():
+            while True:
+                entry = await job_queue.get()
+                if entry is None:
+                    return
+                pending, position, job = entry
+                pending.done(position, await download_artwork_async(aplex, job, store))
+
+        downloaders = [asyncio.create_task(download()) for _ in range(ASYNC_DOWNLOADS)]
+        discoverers = [asyncio.create_task(discover()) for _ in range(ASYNC_DISCOVERY)]
+        await list_sections()
+        for _ in discoverers:
+            await item_queue.put(None)
+        await asyncio.gather(*discoverers)
+        for _ in downloaders:
+            await job_queue.put(None)
+        await asyncio.gather(*downloaders)
+
+# --- PLAN MODE ---
+# Discovery without downloads. PLAN_FILE gets one JSON line per item: its state entries, season slices
+# (as passed to item_finished) and each file's job, target path, source URL and size if known.
+
+def head_size(key):
+    head = plex.head(key)
+    length = head.headers.get("Content-Length")
+    return int(length) if head.status_code == 200 and length else None
+
+def plan_files(jobs):
+    files = []
+    for job in jobs:
+        filename, dest_path, result = artwork_target(*job)
+        size = None
+        if PLAN_HEAD_SIZES:
+            try:
+                size = head_size(result["key"])
+            except Exception as e:
+                log(f"Exception: HEAD {filename} - {e}")
+        # Plex paths stay relative, so the manifest can be run against another address of the same server
+        files.append({
+            "url": result["key"],
+            "dest_path": dest_path,
+            "type": result["type"],
+            "provider": result["provider"],
+            "bytes": size
+        })
+    return files
+
+def plan_entry(store, stats, section, item):
+    section_type = section["type"]
+    jobs, item_found, season_parts = discover_item(store, stats, section_type, section_folder_name(section_type), item)
+    seasons = []
+    for season, label, found, start, end in season_parts:
+        season = {k: v for k, v in season.items() if k != "artwork"}
+        seasons.append([season, label, found, start, end])
+    return {
+        "section": section["title"],
+        "section_type": section_type,
+        "item": item,
+        "item_found": item_found,
+        "seasons": seasons,
+        "files": plan_files(jobs)
+    }
+
+def run_plan(store, sections, summary, processed_shows, processed_movies):
+    # Items are listed here and discovered on PLAN_WORKERS threads; lines are written as items finish
+    plan_file = shard_path(PLAN_FILE)
+    temp_path = plan_file + ".part"
+    lock = threading.Lock()
+    if os.path.exists(shard_path(PLAN_OFFSET_FILE)):
+        os.remove(shard_path(PLAN_OFFSET_FILE))  # Belongs to the previous plan
+
+    def plan_one(section, item, stats):
+        try:
+            entry = plan_entry(store, stats, section, item)
+        except Exception as e:
+            log(f"Exception: discovery for {item['title']} ({item['year']}) - {e}")
+            return
+        with lock:
+            manifest.write(json.dumps(entry) + "\n")
+        sizes = [f["bytes"] for f in entry["files"]]
+        stats.add("planned", len(sizes))
+        stats.add("planned_bytes", sum(size for size in sizes if size))
+        stats.add("unsized", sum(1 for size in sizes if size is None))
+
+    with open(temp_path, "w", encoding="utf-8") as manifest, ThreadPoolExecutor(max_workers=PLAN_WORKERS) as executor:
+        for section in sections:
+            section_type = section["type"]
+            stats = summary[section["title"]]
+            log(f"\nPlanning {section['title']} ({section_folder_name(section_type)})")
+            for item in get_items(section["key"], section_type, limit=MAX_ITEMS or None):
+                if should_skip(store, stats, section_type, item, processed_shows, processed_movies):
+                    continue
+                executor.submit(plan_one, section, item, stats)
+    os.replace(temp_path, plan_file)
+    log(f"\nPlan written to {plan_file}")
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+class LineProgress:
+    # Finished manifest lines. The saved offset is the first unfinished line; lines after it that
+    # finished out of order are run again on restart, where they come back as up to date.
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.offset = int(f.read().strip() or 0)
+        self.finished = set()
+        self.lock = threading.Lock()
+
+    def finish(self, line_no):
+        # Returns True when the offset moved and should be saved
+        with self.lock:
+            self.finished.add(line_no)
+            start = self.offset
+            while self.offset in self.finished:
+                self.finished.remove(self.offset)
+                self.offset += 1
+            return self.offset != start
+
+    def save(self):
+        with self.lock:
+            with open(self.path + ".part", "w", encoding="utf-8") as f:
+                f.write(str(self.offset))
+            os.replace(self.path + ".part", self.path)
+
+class Throughput:
+    # Files and bytes finished so far, printed every PROGRESS_INTERVAL seconds
+    def __init__(self):
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.files = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, results):
+        with self.lock:
+            self.files += len(results)
+            self.bytes += sum(r["bytes"] or 0 for r in results if r["status"] == "done")
+            now = time.monotonic()
+            if now - self.reported < PROGRESS_INTERVAL:
+                return
+            self.reported = now
+        self.report("Progress")
+
+    def report(self, label):
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        log(
+            f"{label}: {self.files} files, {format_bytes(self.bytes)} in {elapsed:.1f}s "
+            f"({self.files / elapsed:.1f} files/s, {format_bytes(self.bytes / elapsed)}/s)"
+        )
+
+def run_manifest(store, summary):
+    # Downloads PLAN_FILE without any discovery. Every line is one item, handed to the same pool
+    # and bookkeeping as a normal run; at most a few items per worker are queued at once.
+    plan_file = shard_path(PLAN_FILE)
+    progress = LineProgress(shard_path(PLAN_OFFSET_FILE))
+    throughput = Throughput()
+    slots = threading.BoundedSemaphore(DOWNLOAD_WORKERS * 4)
+    log(f"Running {plan_file} from line {progress.offset}")
+    with open(plan_file, encoding="utf-8") as manifest, ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for line_no, line in enumerate(manifest):
+            if line_no < progress.offset:
+                continue
+            if not line.strip():
+                progress.finish(line_no)
+                continue
+            entry = json.loads(line)
+            stats = summary.setdefault(entry["section"], SectionStats())
+            stats.add("items")
+            season_parts = [tuple(part) for part in entry["seasons"]]
+            bookkeeping = item_finished(
+                store, stats, entry["section_type"], entry["item"], entry["item_found"], season_parts
+            )
+
+            def on_complete(results, line_no=line_no, bookkeeping=bookkeeping):
+                try:
+                    bookkeeping(results)
+                    throughput.add(results)
+                    if progress.finish(line_no):
+                        # State first, so a saved offset never covers unrecorded downloads
+                        store.commit()
+                        progress.save()
+                finally:
+                    slots.release()
+
+            slots.acquire()
+            jobs = [(f["url"], f["dest_path"], f["type"], f["provider"]) for f in entry["files"]]
+            submit_downloads(executor, store, jobs, on_complete, download=download_planned)
+    throughput.report("Finished")
 
 def main():
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-    processed_shows = load_processed_ids(PROCESSED_SHOWS_FILE)
-    processed_movies = load_processed_ids(PROCESSED_MOVIES_FILE)
-
-    sections = get_sections()
-    for section in sections:
-        section_type = section["type"]
-        section_folder = "Movies" if section_type == "movie" else "TV Shows"
-        print(f"\nScanning {section['title']} ({section_folder})")
-        items = get_items(section["key"], section_type)
-        if MAX_ITEMS:
-            items = items[:MAX_ITEMS]
-        for item in items:
-            # Resume logic for both shows and movies
-            if section_type == "show" and item["ratingKey"] in processed_shows:
-                print(f"Skipping already processed show: {item['title']} ({item['year']})")
-                continue
-            if section_type == "movie" and item["ratingKey"] in processed_movies:
-                print(f"Skipping already processed movie: {item['title']} ({item['year']})")
-                continue
+    if SHARD:
+        log(f"Running shard {SHARD[0]} of {SHARD[1]}")
+    store = StateStore(shard_path(state_db_path()))
+    if not TRANSCODE:
+        # The old files only ever tracked originals
+        store.import_legacy(PROCESSED_SHOWS_FILE, PROCESSED_MOVIES_FILE)
+    processed_shows = store.processed_ids("show")
+    processed_movies = store.processed_ids("movie")
+    if DEDUPE_MODE:
+        hash_index.load(store.written_hashes())
 
-            folder_name = sanitize_filename(item['title'])
-            if item['year']:
-                folder_name += f" ({item['year']})"
-            item_folder = os.path.join(OUTPUT_DIR, section_folder, folder_name)
-            os.makedirs(item_folder, exist_ok=True)
-            found = False
-            # Show/movie-level artwork
-            artwork = get_artwork(item['ratingKey'])
-            # Group by (type, provider) for indexing
-            group = {}
-            for art in artwork:
-                k = (art["type"], art["provider"])
-                group.setdefault(k, []).append(art)
-            for (art_type, provider), arts in group.items():
-                for idx, art in enumerate(arts, 1):
-                    download_artwork(item_folder, idx, item['title'], item['year'], art_type, provider, art["key"])
-                    found = True
-            if not found:
-                print(f"No artwork for {item['title']} ({item['year']})")
-            # ---- SEASON ARTWORK FOR SHOWS ----
-            if section_type == "show":
-                seasons = get_seasons(item['ratingKey'])
-                for season in seasons:
-                    season_folder_name = sanitize_filename(item['title'])
-                    if item['year']:
-                        season_folder_name += f" ({item['year']})"
-                    season_folder_name += f"/Season {season['index']}"
-                    season_folder = os.path.join(OUTPUT_DIR, section_folder, season_folder_name)
-                    os.makedirs(season_folder, exist_ok=True)
-                    season_artwork = get_artwork(season['ratingKey'], exclude_types=["clearlogo", "background"])
-                    group = {}
-                    for art in season_artwork:
-                        k = (art["type"], art["provider"])
-                        group.setdefault(k, []).append(art)
-                    found_season = False
-                    for (art_type, provider), arts in group.items():
-                        for idx, art in enumerate(arts, 1):
-                            download_artwork(
-                                season_folder,
-                                idx,
-                                f"{item['title']} - Season {season['index']}",
-                                season['year'],
-                                art_type,
-                                provider,
-                                art["key"]
-                            )
-                            found_season = True
-                    if not found_season:
-                        print(f"No artwork for {item['title']} Season {season['index']}")
-                mark_id_processed(PROCESSED_SHOWS_FILE, item["ratingKey"])
-            elif section_type == "movie":
-                mark_id_processed(PROCESSED_MOVIES_FILE, item["ratingKey"])
+    summary = {}
+    if POSTPROCESS:
+        postprocessor.start()
+    try:
+        sections = [] if RUN_PLAN else plex.get_sections(SECTION_KEYS)
+        for section in sections:
+            summary[section["title"]] = SectionStats()
+
+        if RUN_PLAN:
+            run_manifest(store, summary)
+        elif PLAN_MODE:
+            run_plan(store, sections, summary, processed_shows, processed_movies)
+        elif ASYNC_MODE:
+            asyncio.run(run_async_pipeline(store, sections, summary, processed_shows, processed_movies))
+        else:
+            # Discovery runs here while the pool downloads; leaving the block waits for all queued jobs
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                def run_section(section):
+                    process_section(executor, store, section, processed_shows, processed_movies, summary[section["title"]])
+
+                if PARALLEL_SECTIONS and len(sections) > 1:
+                    # Each section feeds the shared download pool from its own thread
+                    with ThreadPoolExecutor(max_workers=len(sections)) as section_executor:
+                        for future in [section_executor.submit(run_section, section) for section in sections]:
+                            future.result()
+                else:
+                    for section in sections:
+                        run_section(section)
+    finally:
+        postprocessor.shutdown()
+        store.close()
+
+    if PLAN_MODE:
+        log("\nSummary of artwork plan:")
+        for title, stats in summary.items():
+            log(f"Section: {title}")
+            log(f"  Items scanned: {stats.counts['items']}")
+            log(f"  Skipped: {stats.counts['skipped']}")
+            log(f"  Files planned: {stats.counts['planned']}")
+            if PLAN_HEAD_SIZES:
+                log(f"  Known size: {format_bytes(stats.counts['planned_bytes'])} ({stats.counts['unsized']} files unknown)")
+            log(f"  Discovery requests: {stats.counts['requests']}")
+            log("-" * 30)
+        return
+
+    log("\nSummary of artwork download:")
+    for title, stats in summary.items():
+        log(f"Section: {title}")
+        log(f"  Items scanned: {stats.counts['items']}")
+        log(f"  Skipped: {stats.counts['skipped']}")
+        log(f"  Artwork downloaded: {stats.counts['downloaded']}")
+        log(f"  Artwork failed: {stats.counts['failed']}")
+        log(f"  Discovery requests: {stats.counts['requests']}")
+        if POSTPROCESS:
+            log(f"  Images converted: {stats.counts['converted']} (failed: {stats.counts['convert_failed']})")
+        log("-" * 30)
+
+def merge_shards():
+    # After a sharded run, folds every shard's state DB into STATE_DB so later runs see all of it
+    state_db = state_db_path()
+    base, ext = os.path.splitext(state_db)
+    paths = sorted(glob.glob(f"{glob.escape(base)}.shard*of*{ext}"))
+    if not paths:
+        log(f"No shard state found next to {state_db}")
+        return
+    store = StateStore(state_db)
+    try:
+        for path in paths:
+            StateStore(path).close()  # Brings the shard up to the current schema first
+            store.merge(path)
+            log(f"Merged {path}")
+    finally:
+        store.close()
 
 if __name__ == "__main__":
-    main()
+    args = sys.argv[1:]
+    if args == ["--merge-shards"]:
+        merge_shards()
+    else:
+        if len(args) == 2 and args[0] == "--shard":
+            SHARD = parse_shard(args[1])
+        elif args:
+            sys.exit("Usage: plexartwork.py [--shard i/N | --merge-shards]")
+        main()
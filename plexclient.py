@@ -0,0 +1,373 @@
+import xml.etree.ElementTree as ET
+import asyncio
+import contextvars
+import hashlib
+import io
+import os
+import random
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # Only needed for the async pipeline
+
+# Shared Plex HTTP client used by plexartwork.py and plexlogos.py.
+# One keep-alive session per script, so every call reuses pooled connections to the server.
+
+# Responses worth another attempt after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class AdaptiveLimiter:
+    # Token bucket on the request rate plus an adaptive ceiling on requests in flight.
+    # 429/5xx answers, errors and slow responses halve the ceiling; each run of clean
+    # responses as long as the ceiling raises it by one, back up to max_in_flight.
+    def __init__(self, rate=None, max_in_flight=16, slow_after=10.0):
+        self.rate = rate
+        self.tokens = float(rate or 0)
+        self.updated = time.monotonic()
+        self.max_in_flight = max_in_flight
+        self.ceiling = float(max_in_flight)
+        self.active = 0
+        self.clean = 0
+        self.slow_after = slow_after
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a slot and returns 0, or returns how long to wait before trying again
+        with self.lock:
+            if self.active >= int(self.ceiling):
+                return 0.05
+            if self.rate:
+                now = time.monotonic()
+                self.tokens = min(float(self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < 1:
+                    return (1 - self.tokens) / self.rate
+                self.tokens -= 1
+            self.active += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, status=None, elapsed=0.0):
+        # status None means the request failed without a response
+        with self.lock:
+            self.active -= 1
+            if status is None or status in RETRY_STATUSES or elapsed > self.slow_after:
+                self.ceiling = max(1.0, self.ceiling / 2)
+                self.clean = 0
+            else:
+                self.clean += 1
+                if self.clean >= self.ceiling:
+                    self.ceiling = min(float(self.max_in_flight), self.ceiling + 1)
+                    self.clean = 0
+
+def retry_delay(attempt, retry_after=None, base=0.5, cap=30.0):
+    # Honour Retry-After when the server sends seconds, otherwise full-jitter exponential backoff
+    if retry_after and str(retry_after).isdigit():
+        return min(cap, float(retry_after))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class RequestCounter:
+    # Counts requests (retries included) sent from the current thread or asyncio task while active,
+    # including tasks it starts. Used to see what discovering one item costs.
+    active = contextvars.ContextVar("plex_request_counter", default=None)
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self.token = RequestCounter.active.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        RequestCounter.active.reset(self.token)
+
+    @staticmethod
+    def add():
+        counter = RequestCounter.active.get()
+        if counter is not None:
+            counter.count += 1
+
+class PlexEndpoint:
+    def __init__(self, base_url, token, response_format="xml"):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        # "xml" or "json"; listings fetched with get_container/fetch_container come back in this format
+        self.response_format = response_format
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def headers(self, url, extra=None):
+        headers = dict(extra or {})
+        # Only send the token to the Plex server, never to external artwork hosts
+        if url.startswith(self.base_url):
+            headers["X-Plex-Token"] = self.token
+        return headers
+
+class PlexClient(PlexEndpoint):
+    # Backs off on 429/5xx and slow answers, staying below max_in_flight requests and rate per second
+    def __init__(
+        self, base_url, token, timeout=30, pool_size=10, max_in_flight=None, rate=None, retries=3,
+        response_format="xml"
+    ):
+        super().__init__(base_url, token, response_format)
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Shared by every thread using this client
+        self.limiter = AdaptiveLimiter(rate, max_in_flight or pool_size)
+
+    def send(self, method, path, params=None, headers=None, handler=None, **kwargs):
+        # Sends through the limiter, retrying connection errors and RETRY_STATUSES with jittered backoff.
+        # handler(resp), when given, consumes the body inside the retry loop so a reset mid-body is retried too.
+        url = self.url(path)
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            RequestCounter.add()
+            started = time.monotonic()
+            try:
+                resp = self.session.request(method, url, params=params, headers=self.headers(url, headers), **kwargs)
+                # Time to headers, so a big body on a slow link doesn't read as an overloaded server
+                elapsed = time.monotonic() - started
+                if resp.status_code in RETRY_STATUSES and attempt < self.retries:
+                    resp.close()
+                    self.limiter.release(resp.status_code)
+                    time.sleep(retry_delay(attempt, resp.headers.get("Retry-After")))
+                    continue
+                result = handler(resp) if handler else resp
+            except (
+                requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                # get_parsed reads resp.raw directly, where requests doesn't wrap these
+                ProtocolError, ReadTimeoutError
+            ):
+                self.limiter.release(None)
+                if attempt >= self.retries:
+                    raise
+                time.sleep(retry_delay(attempt))
+                continue
+            except Exception:
+                self.limiter.release(None)
+                raise
+            self.limiter.release(resp.status_code, elapsed)
+            return result
+
+    def get(self, path, params=None, headers=None, **kwargs):
+        return self.send("GET", path, params=params, headers=headers, **kwargs)
+
+    def head(self, path, params=None, headers=None, **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self.send("HEAD", path, params=params, headers=headers, **kwargs)
+
+    def get_parsed(self, path, parse, params=None, headers=None):
+        # Streams the body straight into parse(file_obj), so a large listing is never held in memory whole
+        def handler(resp):
+            resp.raw.decode_content = True
+            return parse(resp.raw)
+        return self.send("GET", path, params=params, headers=headers, handler=handler, stream=True)
+
+    def get_json(self, path, params=None, headers=None):
+        headers = dict(headers or {}, Accept="application/json")
+        return self.send("GET", path, params=params, headers=headers, handler=lambda resp: resp.json())
+
+    def get_container(self, path, parse_xml, parse_json, params=None):
+        # parse_json gets the MediaContainer dict and returns the same shapes as parse_xml
+        if self.response_format == "json":
+            return parse_json(self.get_json(path, params=params)["MediaContainer"])
+        return self.get_parsed(path, parse_xml, params=params)
+
+    def get_sections(self, keys):
+        sections = self.get_container("/library/sections", parse_sections, parse_sections_json)
+        return [section for section in sections if section["key"] in keys]
+
+    def download(self, path, dest_path, headers=None, chunk_size=64 * 1024):
+        # Streams to a temp file beside dest_path: returns (status, headers, temp_path, size, sha256),
+        # with temp_path None unless status is 200
+        def save(resp):
+            if resp.status_code != 200:
+                resp.close()
+                return resp.status_code, resp.headers, None, 0, None
+            return (resp.status_code, resp.headers) + stream_to_temp(resp, dest_path, chunk_size)
+        return self.send("GET", path, headers=headers, handler=save, stream=True)
+
+class AsyncPlexClient(PlexEndpoint):
+    # aiohttp counterpart of PlexClient for the asyncio pipeline; use with "async with".
+    # The connector limit caps requests in flight, so one event loop can keep hundreds open.
+    def __init__(self, base_url, token, timeout=30, max_in_flight=100, rate=None, retries=3, response_format="xml"):
+        if aiohttp is None:
+            raise RuntimeError("Async mode needs aiohttp: pip install aiohttp")
+        super().__init__(base_url, token, response_format)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.limiter = AdaptiveLimiter(rate, max_in_flight)
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def send(self, method, path, handler, params=None, headers=None):
+        # Same limiter and retry policy as PlexClient.send; handler(resp) is awaited inside the response context
+        url = self.url(path)
+        if params:
+            params = {k: str(v) for k, v in params.items()}
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire_async()
+            RequestCounter.add()
+            started = time.monotonic()
+            retry_after = None
+            try:
+                async with self.session.request(method, url, params=params, headers=self.headers(url, headers)) as resp:
+                    elapsed = time.monotonic() - started
+                    if resp.status in RETRY_STATUSES and attempt < self.retries:
+                        # Back off after leaving the context, so the connection isn't held while waiting
+                        retry_after = resp.headers.get("Retry-After", "")
+                        resp.release()
+                    else:
+                        result = await handler(resp)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.limiter.release(None)
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+            except BaseException:
+                self.limiter.release(None)
+                raise
+            if retry_after is not None:
+                self.limiter.release(resp.status)
+                await asyncio.sleep(retry_delay(attempt, retry_after or None))
+                continue
+            self.limiter.release(resp.status, elapsed)
+            return result
+
+    async def fetch(self, path, params=None, headers=None):
+        # Returns (status, headers, body bytes)
+        async def read(resp):
+            return resp.status, resp.headers, await resp.read()
+        return await self.send("GET", path, read, params, headers)
+
+    async def fetch_json(self, path, params=None, headers=None):
+        async def read(resp):
+            return await resp.json(content_type=None)
+        return await self.send("GET", path, read, params, dict(headers or {}, Accept="application/json"))
+
+    async def fetch_container(self, path, parse_xml, parse_json, params=None):
+        if self.response_format == "json":
+            return parse_json((await self.fetch_json(path, params))["MediaContainer"])
+        status, headers, body = await self.fetch(path, params)
+        return parse_xml(body)
+
+    async def head(self, path, params=None, headers=None):
+        async def status(resp):
+            return resp.status, resp.headers
+        return await self.send("HEAD", path, status, params, headers)
+
+    async def download(self, path, dest_path, headers=None, chunk_size=64 * 1024):
+        # Async counterpart of PlexClient.download
+        async def save(resp):
+            if resp.status != 200:
+                return resp.status, resp.headers, None, 0, None
+            temp_path = temp_path_for(dest_path)
+            hasher = hashlib.sha256()
+            size = 0
+            try:
+                with open(temp_path, "xb") as f:
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            except BaseException:
+                discard_temp(temp_path)
+                raise
+            return resp.status, resp.headers, temp_path, size, hasher.hexdigest()
+        return await self.send("GET", path, save, headers=headers)
+
+def iter_xml(source, tags):
+    # Yields (tag, attributes, text) for each wanted element as it closes, from bytes or a file object.
+    # Every element is cleared and detached once read, so memory stays flat however long the document is.
+    # Children close before their parent, so an element's <Image> tags arrive before the element itself.
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    parents = []
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag in tags:
+            yield elem.tag, dict(elem.attrib), elem.text
+        elem.clear()
+        if parents:
+            del parents[-1][-1]
+
+def parse_sections(data):
+    return sections_from(attrib for tag, attrib, _ in iter_xml(data, {"Directory"}))
+
+def parse_sections_json(container):
+    return sections_from(container.get("Directory", []))
+
+def sections_from(directories):
+    # JSON gives the key as a number where XML gives a string
+    return [
+        {"key": str(attrib.get("key")), "title": attrib.get("title"), "type": attrib.get("type")}
+        for attrib in directories
+    ]
+
+def temp_path_for(dest_path):
+    # Unique per download: two jobs can target the same dest_path at once (the same title in two
+    # libraries, or names that sanitize alike), and a shared temp file would mix their bodies
+    return f"{dest_path}.{uuid.uuid4().hex[:12]}.part"
+
+def stream_to_temp(resp, dest_path, chunk_size=64 * 1024):
+    # Writes a streamed response body to a temp file beside dest_path and returns (temp_path, size, sha256).
+    # Callers os.replace() it into place when complete, so a crash never leaves a truncated dest_path.
+    temp_path = temp_path_for(dest_path)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "xb") as f:
+            for chunk in resp.iter_content(chunk_size):
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        discard_temp(temp_path)
+        raise
+    return temp_path, size, hasher.hexdigest()
+
+def discard_temp(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
@@ -1,12 +1,30 @@
-import requests
-import xml.etree.ElementTree as ET
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from plexclient import PlexClient, iter_xml
 
 PLEX_URL = "http://address_here:32400"
 PLEX_TOKEN = "token_here"
 OUTPUT_DIR = "logos"
 SECTION_KEYS = ["1", "2"]  # Only these libraries will be scanned
+REQUEST_TIMEOUT = 30  # Seconds to wait for Plex before a request fails
+PLEX_FORMAT = "xml"  # Ask Plex for "xml" or "json" (cheaper to decode on large libraries)
+PAGE_SIZE = 200  # Items fetched per page when listing a library
+METADATA_BATCH_SIZE = 50  # Items looked up per metadata request when finding clearLogos
+PARALLEL_SECTIONS = False  # Scan all libraries at the same time instead of one after another
+MAX_IN_FLIGHT = 8  # Most requests sent to Plex at once, across all libraries
+RATE_LIMIT = 50  # Most requests per second sent to Plex (set to None for no limit)
+MAX_RETRIES = 3  # Extra attempts after a connection error or 429/5xx answer
+
+plex = PlexClient(
+    PLEX_URL, PLEX_TOKEN,
+    timeout=REQUEST_TIMEOUT,
+    pool_size=MAX_IN_FLIGHT,
+    max_in_flight=MAX_IN_FLIGHT,
+    rate=RATE_LIMIT,
+    retries=MAX_RETRIES,
+    response_format=PLEX_FORMAT
+)
 
 def debug(msg):
     print(f"[DEBUG] {msg}")
@@ -14,92 +32,138 @@ def debug(msg):
 def sanitize_filename(text):
     return re.sub(r'[^a-zA-Z0-9 .()-]', '', text)
 
-def get_sections():
-    url = f"{PLEX_URL}/library/sections?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
-    sections = []
-    for directory in root.findall(".//Directory"):
-        key = directory.attrib.get("key")
-        title = directory.attrib.get("title")
-        if key in SECTION_KEYS:
-            sections.append({"key": key, "title": title})
-    return sections
+def iter_with_logos(data):
+    # Yields (attributes, logo_path) for each Video/Directory. Their <Image>/<clearLogo> children
+    # close first, so the logo is collected before the element itself comes through.
+    image_logo = None
+    text_logo = None
+    for tag, attrib, text in iter_xml(data, {"Video", "Directory", "Image", "clearLogo"}):
+        if tag == "Image":
+            if attrib.get("type") == "clearLogo" and not image_logo:
+                image_logo = attrib.get("url")
+        elif tag == "clearLogo":
+            text_logo = text_logo or text
+        else:
+            yield attrib, image_logo or text_logo
+            image_logo = None
+            text_logo = None
 
-def get_items(section_key):
-    url = f"{PLEX_URL}/library/sections/{section_key}/all?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
+def json_with_logos(container):
+    # JSON equivalent of iter_with_logos: clearLogo images sit in each entry's "Image" list
+    for entry in container.get("Metadata", []):
+        logo = next((image.get("url") for image in entry.get("Image", []) if image.get("type") == "clearLogo"), None)
+        yield entry, logo or entry.get("clearLogo")
+
+def parse_items_page(data):
+    return items_from(iter_with_logos(data))
+
+def parse_items_page_json(container):
+    return items_from(json_with_logos(container))
+
+def items_from(entries):
     items = []
-    for item in root.findall(".//Video"):
-        ratingKey = item.attrib.get("ratingKey")
-        title = item.attrib.get("title")
-        year = item.attrib.get("year", "")
-        items.append({"ratingKey": ratingKey, "title": title, "year": year})
-    for item in root.findall(".//Directory"):
-        ratingKey = item.attrib.get("ratingKey")
-        title = item.attrib.get("title")
-        year = item.attrib.get("year", "")
-        items.append({"ratingKey": ratingKey, "title": title, "year": year})
+    for attrib, logo in entries:
+        ratingKey = str(attrib.get("ratingKey"))
+        title = attrib.get("title")
+        year = str(attrib.get("year", ""))
+        items.append({"ratingKey": ratingKey, "title": title, "year": year, "logo": logo})
     return items
 
-def find_clearlogo(ratingKey):
-    url = f"{PLEX_URL}/library/metadata/{ratingKey}?X-Plex-Token={PLEX_TOKEN}"
-    resp = requests.get(url)
-    root = ET.fromstring(resp.text)
-    logo_path = None
-    for image in root.iter("Image"):
-        if image.attrib.get("type") == "clearLogo":
-            logo_path = image.attrib.get("url")
-            break
-    if not logo_path:
-        for el in root.iter("clearLogo"):
-            logo_path = el.text
+def get_items(section_key):
+    # Yields items a page at a time instead of loading the whole section listing at once.
+    # Plex includes <Image> tags in the listing when asked, so many logos are known without a metadata call.
+    start = 0
+    while True:
+        items = plex.get_container(
+            f"/library/sections/{section_key}/all",
+            parse_items_page,
+            parse_items_page_json,
+            params={"X-Plex-Container-Start": start, "X-Plex-Container-Size": PAGE_SIZE, "includeImages": 1}
+        )
+        yield from items
+        start += len(items)
+        if len(items) < PAGE_SIZE:
             break
-    return logo_path
 
-def main():
-    debug(f"Scanning Plex libraries: {SECTION_KEYS}")
-    sections = get_sections()
-    summary = {}
+def parse_logos(data):
+    return logos_from(iter_with_logos(data))
 
-    for section in sections:
-        debug(f"Scanning library: {section['title']} (key={section['key']})")
-        library_folder = os.path.join(OUTPUT_DIR, sanitize_filename(section["title"]))
-        os.makedirs(library_folder, exist_ok=True)
-        items = get_items(section["key"])
-        total_items = 0
-        logo_found = 0
-        logo_missing = 0
-        for item in items:
+def parse_logos_json(container):
+    return logos_from(json_with_logos(container))
+
+def logos_from(entries):
+    logos = {}
+    for attrib, logo in entries:
+        ratingKey = attrib.get("ratingKey")
+        if ratingKey:
+            logos[str(ratingKey)] = logo
+    return logos
+
+def find_clearlogos(rating_keys):
+    # Plex accepts comma-separated rating keys, so a whole batch is resolved in one request
+    return plex.get_container(f"/library/metadata/{','.join(rating_keys)}", parse_logos, parse_logos_json)
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_section(section):
+    debug(f"Scanning library: {section['title']} (key={section['key']})")
+    library_folder = os.path.join(OUTPUT_DIR, sanitize_filename(section["title"]))
+    os.makedirs(library_folder, exist_ok=True)
+    total_items = 0
+    logo_found = 0
+    logo_missing = 0
+    for batch in batched(get_items(section["key"]), METADATA_BATCH_SIZE):
+        lookup = [item["ratingKey"] for item in batch if not item["logo"]]
+        logos = find_clearlogos(lookup) if lookup else {}
+        for item in batch:
             total_items += 1
             debug(f"Scanning item: {item['title']} ({item['year']}), ratingKey={item['ratingKey']}")
-            logo_path = find_clearlogo(item["ratingKey"])
+            logo_path = item["logo"] or logos.get(item["ratingKey"])
             if logo_path:
                 filename = f"{sanitize_filename(item['title'])} ({item['year']}) clearlogo.png"
                 dest_path = os.path.join(library_folder, filename)
-                logo_url = f"{PLEX_URL}{logo_path}?X-Plex-Token={PLEX_TOKEN}"
-                debug(f"Downloading clearLogo from {logo_url}")
-                response = requests.get(logo_url)
-                if response.status_code == 200:
-                    with open(dest_path, "wb") as f:
-                        f.write(response.content)
+                debug(f"Downloading clearLogo from {plex.url(logo_path)}")
+                status, headers, temp_path, size, digest = plex.download(logo_path, dest_path)
+                if status == 200:
+                    os.replace(temp_path, dest_path)
                     print(f"Downloaded: {dest_path}")
                     logo_found += 1
                 else:
                     print(f"Failed to download logo for {item['title']} ({item['year']})")
-                    debug(f"HTTP status: {response.status_code}, content: {response.text[:200]}")
+                    debug(f"HTTP status: {status}")
                     logo_missing += 1
             else:
                 print(f"No clearLogo for {item['title']} ({item['year']}) in {section['title']}")
                 debug(f"No clearLogo found for {item['title']} ({item['year']}) in {section['title']}")
                 logo_missing += 1
-        summary[section['title']] = {
-            "total": total_items,
-            "with_logo": logo_found,
-            "missing_logo": logo_missing
-        }
-        debug(f"Section summary for {section['title']}: total={total_items}, with_logo={logo_found}, missing_logo={logo_missing}")
+    debug(f"Section summary for {section['title']}: total={total_items}, with_logo={logo_found}, missing_logo={logo_missing}")
+    return {
+        "total": total_items,
+        "with_logo": logo_found,
+        "missing_logo": logo_missing
+    }
+
+def main():
+    debug(f"Scanning Plex libraries: {SECTION_KEYS}")
+    sections = plex.get_sections(SECTION_KEYS)
+    summary = {}
+
+    if PARALLEL_SECTIONS and len(sections) > 1:
+        # Each library runs its own item pipeline; the client caps total requests in flight
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            results = list(executor.map(process_section, sections))
+    else:
+        results = [process_section(section) for section in sections]
+    for section, stats in zip(sections, results):
+        summary[section['title']] = stats
 
     print("\nSummary of logo download:")
     for libname, stats in summary.items():
@@ -1,10 +1,14 @@
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
 import datetime
+import json
 import webbrowser
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # =================================================
 # ================= CONFIGURATION =================
@@ -38,6 +42,40 @@ LOG_FILE = "check_seasons.log"
 # available too far ahead unless the show is pretty mainstream.
 LOOKAHEAD_DAYS = 21 
 
+# TMDB API SETTINGS
+# Shows are checked this many at a time.
+TMDB_WORKERS = 8
+# Most TMDB requests per second. TMDB allows roughly 50 per second per IP,
+# so this leaves some headroom.
+TMDB_RATE_LIMIT = 40
+# Extra attempts when TMDB answers 429 (too many requests).
+TMDB_RETRIES = 3
+
+# TMDB CACHE SETTINGS
+# Show details are kept on disk between runs so frequent runs skip most API calls.
+# Set TMDB_CACHE_FILE to "" to always ask TMDB.
+TMDB_CACHE_FILE = "tmdb_cache.json"
+# Shows with a next episode inside (or close to) the lookahead window are re-checked after this many hours.
+CACHE_HOURS_UPCOMING = 6
+# Shows with no next episode scheduled are re-checked after this many days.
+CACHE_DAYS_IDLE = 3
+# Shows whose next episode is far off are cached until it nears the window, but never longer than this.
+CACHE_DAYS_MAX = 7
+
+# FOLDER SCAN INDEX
+# Folder contents are remembered between runs, so a rescan only lists folders whose
+# modified time changed. Set SCAN_INDEX_FILE to "" to always walk everything.
+SCAN_INDEX_FILE = "scan_index.json"
+# Set to True to ignore the saved index and rebuild it from a full scan.
+REBUILD_SCAN_INDEX = False
+
+# INCREMENTAL MODE
+# Ask TMDB which shows changed since the last run and only re-check those; everything else
+# comes from the cache. Needs TMDB_CACHE_FILE.
+INCREMENTAL_MODE = False
+# Re-check every show anyway after this many days, as a safety net.
+FULL_REFRESH_DAYS = 7
+
 # =================================================
 # ============= DO NOT EDIT PAST HERE =============
 # =================================================
@@ -50,6 +88,117 @@ SPECIALS_REGEX = r'(?i)\s-\sspecials'
 # TRANSPARENT SPACER IMAGE TO KEEP DISCORD MESSAGES CONSISTANT WIDTH
 SPACER_IMAGE_URL = "https://raw.githubusercontent.com/dweagle/extras/refs/heads/main/poster_to_do/spacer.png"
 
+# TMDB HTTP SESSION (keep-alive connections shared by the worker threads)
+tmdb_session = requests.Session()
+tmdb_session.mount("https://", HTTPAdapter(pool_connections=TMDB_WORKERS, pool_maxsize=TMDB_WORKERS))
+
+# Token bucket: allows short bursts but never more than TMDB_RATE_LIMIT requests per second on average
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+tmdb_limiter = RateLimiter(TMDB_RATE_LIMIT)
+
+# On-disk cache of TMDB show details, keyed by TMDB ID
+class TMDBCache:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        # Incremental mode: date the changes feed was last read from, and when every show was last re-checked
+        self.changes_since = None
+        self.last_full_refresh = 0
+        # trusted: unchanged shows are used even past their expiry
+        # refresh_before: full refresh, entries fetched before this time are ignored
+        self.trusted = False
+        self.refresh_before = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    saved = json.load(f)
+                self.entries = saved.get('shows', {})
+                self.changes_since = saved.get('changes_since')
+                self.last_full_refresh = saved.get('last_full_refresh', 0)
+            except (OSError, ValueError, AttributeError) as e:
+                logging.warning(f"Ignoring unreadable TMDB cache {path}: {e}")
+
+    def get(self, tmdb_id):
+        with self.lock:
+            entry = self.entries.get(tmdb_id)
+            if entry and entry.get('fetched', 0) >= self.refresh_before:
+                if entry['expires'] > time.time() or (self.trusted and not episode_passed(entry['data'])):
+                    self.hits += 1
+                    return entry['data']
+            self.misses += 1
+            return None
+
+    def forget(self, tmdb_ids):
+        with self.lock:
+            for tmdb_id in tmdb_ids:
+                self.entries.pop(tmdb_id, None)
+
+    def put(self, tmdb_id, data):
+        # Only the fields this script reads are kept
+        data = {key: data.get(key) for key in ('name', 'status', 'next_episode_to_air')}
+        with self.lock:
+            now = time.time()
+            self.entries[tmdb_id] = {'fetched': now, 'expires': now + cache_lifetime(data), 'data': data}
+        return data
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        with self.lock:
+            # Incremental mode keeps expired entries, they stay valid until TMDB reports a change
+            entries = {k: v for k, v in self.entries.items() if INCREMENTAL_MODE or v['expires'] > now}
+            saved = {
+                'changes_since': self.changes_since,
+                'last_full_refresh': self.last_full_refresh,
+                'shows': entries
+            }
+        with open(self.path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(saved, f)
+        os.replace(self.path + ".tmp", self.path)
+
+def cache_lifetime(data):
+    # Seconds to trust a show's details: short while a premiere could land in the window, long otherwise
+    upcoming = CACHE_HOURS_UPCOMING * 3600
+    next_ep = data.get('next_episode_to_air')
+    if not next_ep or not next_ep.get('air_date'):
+        return CACHE_DAYS_IDLE * 86400
+    try:
+        ep_date = datetime.datetime.strptime(next_ep['air_date'], "%Y-%m-%d").date()
+    except ValueError:
+        return upcoming
+    # Days until the episode first falls inside LOOKAHEAD_DAYS
+    days_until_window = (ep_date - datetime.date.today()).days - LOOKAHEAD_DAYS
+    if days_until_window <= 0:
+        return upcoming
+    return max(upcoming, min(days_until_window, CACHE_DAYS_MAX) * 86400)
+
+def episode_passed(data):
+    # next_episode_to_air moves on when an episode airs, which the changes feed does not report
+    next_ep = data.get('next_episode_to_air') or {}
+    return bool(next_ep.get('air_date')) and next_ep['air_date'] < datetime.date.today().isoformat()
+
 # Logging
 logging.basicConfig(
     filename=LOG_FILE,
@@ -58,6 +207,9 @@ logging.basicConfig(
     filemode='w'
 )
 
+# Created after logging is set up, so a warning about an unreadable cache lands in LOG_FILE
+tmdb_cache = TMDBCache(TMDB_CACHE_FILE)
+
 # Terminal Progress Bar
 def print_progress(iteration, total, prefix='', suffix='', decimals=1, length=40):
     if total == 0:
@@ -210,6 +362,86 @@ def get_show_name_from_file(filename):
         return match.group(1).strip()
     return filename 
 
+def parse_poster_filename(filename):
+    # Returns [tmdb_id, season, filename] for a show poster (season None for the main poster), else None
+    tmdb_match = re.search(TMDB_REGEX, filename, re.IGNORECASE)
+    
+    if tmdb_match:
+        tmdb_id = tmdb_match.group(1)
+        
+        # Check if the file is a show
+        has_tvdb = re.search(TVDB_REGEX, filename, re.IGNORECASE)
+        season_match = re.search(SEASON_NUMBER_REGEX, filename, re.IGNORECASE)
+        specials_match = re.search(SPECIALS_REGEX, filename, re.IGNORECASE)
+
+        if season_match:
+            return [tmdb_id, int(season_match.group(1)), filename]
+        if specials_match:
+            return [tmdb_id, 0, filename]
+        if has_tvdb:
+            return [tmdb_id, None, filename]
+    return None
+
+# Saved folder listings: {library path: {folder: {'mtime', 'subdirs', 'posters'}}}
+class ScanIndex:
+    def __init__(self, path):
+        self.path = path
+        self.libraries = {}
+        if path and os.path.exists(path) and not REBUILD_SCAN_INDEX:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.libraries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable scan index {path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(self.libraries, f)
+        os.replace(self.path + ".tmp", self.path)
+
+scan_index = ScanIndex(SCAN_INDEX_FILE)
+
+def list_folder(folder, mtime):
+    # One folder's subfolders and parsed poster files (like os.walk, symlinked folders are not followed)
+    subdirs = []
+    posters = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+                continue
+            poster = parse_poster_filename(entry.name)
+            if poster:
+                posters.append(poster)
+    return {'mtime': mtime, 'subdirs': subdirs, 'posters': posters}
+
+def walk_posters(path):
+    # Yields poster entries under path. A folder's listing changes its mtime, so folders with the
+    # same mtime as last run reuse the saved listing; only their subfolders still get a stat.
+    old_folders = scan_index.libraries.get(path, {}) if scan_index.path else {}
+    folders = {}
+    listed = 0
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            entry = old_folders.get(folder)
+            if entry is None or entry['mtime'] != mtime:
+                entry = list_folder(folder, mtime)
+                listed += 1
+        except OSError as e:
+            logging.warning(f"Could not read folder {folder}: {e}")
+            continue
+        folders[folder] = entry
+        stack.extend(os.path.join(folder, sub) for sub in reversed(entry['subdirs']))
+        yield from entry['posters']
+    scan_index.libraries[path] = folders
+    logging.info(f"Listed {listed} of {len(folders)} folders under {path}")
+
 def scan_library(path, library_name):
     inventory = {}
     log_buffer = {}
@@ -222,37 +454,21 @@ def scan_library(path, library_name):
         print(f"Error: Path not found: {path}")
         return {}
 
-    for root, dirs, files in os.walk(path):
-        for filename in files:
-            tmdb_match = re.search(TMDB_REGEX, filename, re.IGNORECASE)
+    for tmdb_id, s_num, filename in walk_posters(path):
+        if tmdb_id not in inventory:
+            inventory[tmdb_id] = set()
+        
+        if tmdb_id not in log_buffer:
+            show_name = get_show_name_from_file(filename)
+            log_buffer[tmdb_id] = {'name': show_name, 'main': [], 'seasons': set()}
+        
+        if s_num is not None:
+            inventory[tmdb_id].add(s_num)
+            log_buffer[tmdb_id]['seasons'].add(s_num)
             
-            if tmdb_match:
-                tmdb_id = tmdb_match.group(1)
-                
-                # Check if the file is a show
-                has_tvdb = re.search(TVDB_REGEX, filename, re.IGNORECASE)
-                season_match = re.search(SEASON_NUMBER_REGEX, filename, re.IGNORECASE)
-                specials_match = re.search(SPECIALS_REGEX, filename, re.IGNORECASE)
-
-                if has_tvdb or season_match or specials_match:
-                    if tmdb_id not in inventory:
-                        inventory[tmdb_id] = set()
-                    
-                    if tmdb_id not in log_buffer:
-                        show_name = get_show_name_from_file(filename)
-                        log_buffer[tmdb_id] = {'name': show_name, 'main': [], 'seasons': set()}
-                    
-                    if season_match:
-                        s_num = int(season_match.group(1))
-                        inventory[tmdb_id].add(s_num)
-                        log_buffer[tmdb_id]['seasons'].add(s_num)
-                    
-                    elif specials_match:
-                        inventory[tmdb_id].add(0)
-                        log_buffer[tmdb_id]['seasons'].add(0)
-                        
-                    else:
-                        log_buffer[tmdb_id]['main'].append(filename)
+        else:
+            log_buffer[tmdb_id]['main'].append(filename)
+    scan_index.save()
 
     # Work with files and log
     sorted_shows = sorted(log_buffer.values(), key=lambda x: x['name'].lower())
@@ -273,10 +489,28 @@ def scan_library(path, library_name):
     print(f"[{library_name}] Found {len(inventory)} unique shows.")
     return inventory
 
-def check_show_status(tmdb_id, existing_seasons):
+def tmdb_get(url):
+    # Waits for the limiter before every attempt and honours Retry-After on 429
+    for attempt in range(TMDB_RETRIES + 1):
+        tmdb_limiter.acquire()
+        response = tmdb_session.get(url, timeout=10)
+        if response.status_code != 429 or attempt == TMDB_RETRIES:
+            return response
+        try:
+            delay = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            delay = 1
+        logging.warning(f"TMDB rate limit hit, retrying in {delay}s")
+        time.sleep(delay)
+
+def get_show_details(tmdb_id):
+    data = tmdb_cache.get(tmdb_id)
+    if data is not None:
+        return data
+
     url = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={TMDB_API_KEY}&language=en-US"
     try:
-        response = requests.get(url, timeout=10)
+        response = tmdb_get(url)
     except Exception as e:
         logging.error(f"Connection error for ID {tmdb_id}: {e}")
         return None
@@ -285,7 +519,56 @@ def check_show_status(tmdb_id, existing_seasons):
         logging.warning(f"API Error {response.status_code} for ID {tmdb_id}")
         return None
 
-    data = response.json()
+    return tmdb_cache.put(tmdb_id, response.json())
+
+def get_changed_show_ids(start_date):
+    # All TV IDs TMDB changed since start_date, or None if the feed could not be read
+    changed = set()
+    page = 1
+    while True:
+        url = f"https://api.themoviedb.org/3/tv/changes?api_key={TMDB_API_KEY}&start_date={start_date}&page={page}"
+        try:
+            response = tmdb_get(url)
+        except Exception as e:
+            logging.error(f"Connection error reading TMDB changes: {e}")
+            return None
+        if response.status_code != 200:
+            logging.warning(f"API Error {response.status_code} reading TMDB changes")
+            return None
+        data = response.json()
+        changed.update(str(show['id']) for show in data.get('results', []))
+        if page >= data.get('total_pages', 1):
+            return changed
+        page += 1
+
+def start_incremental_run():
+    # Decides between a full refresh and a changes-only run, and drops changed shows from the cache
+    # /tv/changes dates are UTC days, so the saved date is too; a local date runs ahead east of UTC
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    since = tmdb_cache.changes_since
+    # TMDB's changes feed covers at most 14 days
+    too_old = not since or (today - datetime.date.fromisoformat(since)).days > 14
+    if too_old or time.time() - tmdb_cache.last_full_refresh > FULL_REFRESH_DAYS * 86400:
+        print("Incremental mode: full refresh, checking every show.")
+        logging.info("Incremental mode: full refresh")
+        tmdb_cache.refresh_before = tmdb_cache.last_full_refresh = time.time()
+        tmdb_cache.changes_since = today.isoformat()
+        return
+    changed = get_changed_show_ids(since)
+    if changed is None:
+        print("Incremental mode: could not read TMDB changes, using normal cache expiry.")
+        return
+    tmdb_cache.forget(changed)
+    tmdb_cache.trusted = True
+    tmdb_cache.changes_since = today.isoformat()
+    print(f"Incremental mode: {len(changed)} shows changed on TMDB since {since}.")
+    logging.info(f"Incremental mode: {len(changed)} changed shows since {since}")
+
+def check_show_status(tmdb_id, data, existing_seasons):
+    # data is the show's TMDB details, looked up once and shared by every folder the show is in
+    if data is None:
+        return None
+
     name = data.get('name', 'Unknown')
     next_ep = data.get('next_episode_to_air')
     
@@ -479,6 +762,9 @@ if __name__ == "__main__":
     # Start message
     send_discord_start()
 
+    if INCREMENTAL_MODE and TMDB_CACHE_FILE:
+        start_incremental_run()
+
     all_results = {}
     
     # Global Discord Summary
@@ -486,30 +772,40 @@ if __name__ == "__main__":
     global_upcoming = 0
     global_needed = 0
 
+    inventories = {}
     for lib_name, lib_path in LIBRARY_CONFIG.items():
-        inventory = scan_library(lib_path, lib_name)
+        inventories[lib_name] = scan_library(lib_path, lib_name)
+
+    # Folders overlap, so each TMDB ID is looked up once and the answer shared between them
+    tmdb_ids = sorted(set().union(*inventories.values()))
+    total = len(tmdb_ids)
+    show_details = {}
+    
+    print(f"\nChecking TMDB API for upcoming seasons ({total} unique shows across {len(inventories)} folders)...")
+    print_progress(0, total, prefix='Progress:', suffix='Complete', length=40)
+
+    # Lookups run in parallel behind the rate limiter; the bar moves as each one finishes
+    with ThreadPoolExecutor(max_workers=TMDB_WORKERS) as executor:
+        futures = {executor.submit(get_show_details, tmdb_id): tmdb_id for tmdb_id in tmdb_ids}
+        for i, future in enumerate(as_completed(futures)):
+            show_details[futures[future]] = future.result()
+            print_progress(i + 1, total, prefix='Progress:', suffix='Complete', length=40)
+    
+    tmdb_cache.save()
+
+    for lib_name, lib_path in LIBRARY_CONFIG.items():
+        inventory = inventories[lib_name]
         
         if not inventory and not os.path.exists(lib_path):
             all_results[lib_name] = {'shows': [], 'total_scanned': 0}
             continue
 
-        tmdb_ids = list(inventory.keys())
-        total = len(tmdb_ids)
-        
         current_lib_shows = []
-        
-        print(f"[{lib_name}] Checking TMDB API for upcoming seasons...")
-        print_progress(0, total, prefix='Progress:', suffix='Complete', length=40)
-
-        for i, tmdb_id in enumerate(tmdb_ids):
-            existing_seasons = inventory[tmdb_id]
-            result = check_show_status(tmdb_id, existing_seasons)
+        for tmdb_id, existing_seasons in inventory.items():
+            result = check_show_status(tmdb_id, show_details[tmdb_id], existing_seasons)
             
             if result:
                 current_lib_shows.append(result)
-            
-            time.sleep(0.1)
-            print_progress(i + 1, total, prefix='Progress:', suffix='Complete', length=40)
         
         # SEND FOLDER REPORT
         scanned_count = len(inventory)
@@ -528,6 +824,9 @@ if __name__ == "__main__":
             'total_scanned': scanned_count
         }
     
+    logging.info(f"TMDB cache: {tmdb_cache.hits} hits, {tmdb_cache.misses} API lookups")
+    print(f"\nTMDB cache: {tmdb_cache.hits} hits, {tmdb_cache.misses} API lookups")
+    
     # SEND END MESSAGE
     send_discord_end(global_scanned, global_upcoming, global_needed)
     